@@ -1,6 +1,7 @@
 import sys
 import os
 import argparse
+import logging
 
 class SkipProcessing(Exception):
     """Signal that a file should be skipped without counting as failure."""
@@ -8,7 +9,7 @@ class SkipProcessing(Exception):
 import json
 import csv
 import math
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, time, timezone
 from typing import List
 from dateutil import parser as date_parser
 from dateutil import tz
@@ -16,13 +17,69 @@ from zoneinfo import ZoneInfo
 import glob
 from zipfile import ZipFile
 from io import TextIOWrapper
-
-class SleepSegment:
-    def __init__(self, start: datetime, stage: str):
-        self.Start = start
-        self.Stage = stage
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby, takewhile
+from bisect import bisect_left
+
+# orjson is optional; it parses the raw file bytes considerably faster than the json module
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# ijson is optional; with it, JSON files of at least this size are parsed incrementally
+try:
+    import ijson
+except ImportError:
+    ijson = None
+JSON_STREAMING_THRESHOLD = 32 << 20
+
+log = logging.getLogger(__name__)
+
+# Created once: every tzlocal() call builds a new object that re-reads the system time zone
+LOCAL_TZ = tz.tzlocal()
+
+SEGMENT_SECONDS = 30
+SEGMENT_LENGTH = timedelta(seconds=SEGMENT_SECONDS)
+
+# Segments hold one small integer code per 30-second slot, indexing into STAGE_NAMES
+STAGE_NAMES = ["WAKE", "Light", "Deep", "REM", "Asleep"]
+STAGE_CODES = {name: code for code, name in enumerate(STAGE_NAMES)}
+WAKE = STAGE_CODES["WAKE"]
+# bytes.translate table mapping WAKE to 0 and every other stage code to 1
+SLEEP_MASK = bytes(int(code != WAKE) for code in range(256))
+# Per stage code, a bytes.translate table replacing WAKE with that code and keeping other codes
+WAKE_FILL_TABLES = [bytes(fill if code == WAKE else code for code in range(256)) for fill in range(len(STAGE_NAMES))]
+
+# Map Apple Health stage values to the stages written to the hypnogram
+SLEEP_STAGE_MAPPING = {
+    "Core": "Light",
+    "Asleep": "Asleep",
+    "Deep": "Deep",
+    "REM": "REM",
+    "Awake": "WAKE",
+    "InBed": "WAKE"
+}
+# Same mapping straight to stage codes; values missing from it map to WAKE
+SLEEP_STAGE_CODES = {stage: STAGE_CODES[name] for stage, name in SLEEP_STAGE_MAPPING.items()}
+
+# Map stage values found in csv files to those in JSON files
+HEALTH_EXPORT_CSV_STAGE_MAPPING = {
+    "asleep":       "Asleep",
+    "asleepCore":   "Core",
+    "asleepDeep":   "Deep",
+    "asleepREM":    "REM",
+    "awake":        "Awake",
+    "inBed":        "InBed"
+}
+
+OUTPUT_HEADER = "Type;Start Time;Stop Time;Sleep Duration;Sleep Onset Duration;Light Sleep Duration;Deep Sleep Duration;REM Duration;Wake After Sleep Onset Duration;Number of awakenings;Position Changes;Mean Heart Rate;Mean Respiration CPM;Number of Stimulations;Sleep efficiency;Hypnogram"
+OUTPUT_BUFFER_SIZE = 1 << 16
 
 class SleepEntry:
+    __slots__ = ("Source", "Qty", "StartDate", "Value", "EndDate")
+
     def __init__(self, source: str, qty: float, start_date: datetime, value: str, end_date: datetime):
         self.Source = source
         self.Qty = qty
@@ -49,127 +106,139 @@ class OutputData:
         self.SleepEfficiency = 0
         self.Hypnogram = ''
 
+# Fixed UTC offsets seen so far, keyed by their "+HHMM" string
+utc_offsets = {}
+
+def parse_utc_offset(offset: str) -> timezone:
+    tzinfo = utc_offsets.get(offset)
+    if tzinfo is None:
+        if len(offset) != 5 or offset[0] not in '+-':
+            raise ValueError(f"Invalid UTC offset '{offset}'")
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        tzinfo = timezone(-delta if offset[0] == '-' else delta)
+        utc_offsets[offset] = tzinfo
+    return tzinfo
+
 def parse_iso8601(date_string: str) -> datetime:
+    # Fast path for the fixed format written by the export apps, e.g. "2024-01-15 22:34:56 +0100"
+    try:
+        if len(date_string) == 25 and date_string[4] + date_string[7] + date_string[10] + date_string[13] + date_string[16] + date_string[19] == "-- :: ":
+            return datetime(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10]),
+                            int(date_string[11:13]), int(date_string[14:16]), int(date_string[17:19]),
+                            tzinfo=parse_utc_offset(date_string[20:]))
+    except (ValueError, TypeError):
+        pass
+
     try:
         return date_parser.parse(date_string)
     except (ValueError, TypeError):
         print(f"Warning: Invalid date format '{date_string}'. Using current date and time.")
-        return datetime.now(tz=tz.tzlocal())
+        return datetime.now(tz=LOCAL_TZ)
 
-def create_30s_segments(start_time: datetime, end_time: datetime) -> List[SleepSegment]:
-    segments = []
-    current_time = start_time
-    while current_time < end_time:
-        segments.append(SleepSegment(start=current_time, stage='WAKE'))
-        current_time += timedelta(seconds=30)
-    return segments
+def create_30s_segments(start_time: datetime, end_time: datetime) -> bytearray:
+    # Segment i starts at start_time + i * SEGMENT_LENGTH; every segment starts out as WAKE
+    count = -((start_time - end_time) // SEGMENT_LENGTH)
+    return bytearray([WAKE]) * max(0, count)
 
 def map_sleep_stage(stage: str) -> str:
-    mapping = {
-        "Core": "Light",
-        "Asleep": "Asleep",
-        "Deep": "Deep",
-        "REM": "REM",
-        "Awake": "WAKE",
-        "InBed": "WAKE"
-    }
-    return mapping.get(stage, "WAKE")
+    return SLEEP_STAGE_MAPPING.get(stage, "WAKE")
 
 def health_export_csv_map_sleep_stage(stage: str) -> str:
-    # Map stage values found in csv files to those in JSON files
-    mapping = {
-        "asleep":       "Asleep",
-        "asleepCore":   "Core",
-        "asleepDeep":   "Deep",
-        "asleepREM":    "REM",
-        "awake":        "Awake",
-        "inBed":        "InBed"
-    }
-    return mapping.get(stage, "Awake")
-
-def update_segments_with_sleep_data(segments: List[SleepSegment], sleep_data: List[SleepEntry]):
+    return HEALTH_EXPORT_CSV_STAGE_MAPPING.get(stage, "Awake")
+
+def update_segments_with_sleep_data(segments: bytearray, start_time: datetime, sleep_data: List[SleepEntry]):
+    last_index = len(segments) - 1
+
     for entry in sleep_data:
-        start = entry.StartDate
-        end = entry.EndDate
-        stage = map_sleep_stage(entry.Value)
+        code = SLEEP_STAGE_CODES.get(entry.Value, WAKE)
+        if code == WAKE:
+            # Segments start out as WAKE, so a WAKE entry cannot change anything
+            continue
 
-        for segment in segments:
-            if start <= segment.Start <= end and segment.Stage == "WAKE":
-                segment.Stage = stage
+        # Segments are evenly spaced, so the ones covered by an entry can be found by arithmetic:
+        # first segment starting at or after the entry start, last one starting at or before its end
+        first = max(0, -((start_time - entry.StartDate) // SEGMENT_LENGTH))
+        last = min(last_index, (entry.EndDate - start_time) // SEGMENT_LENGTH)
 
-def calculate_duration(start: datetime, end: datetime) -> str:
-    duration = end - start
-    total_seconds = int(duration.total_seconds())
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    seconds = total_seconds % 60
-    return f"{hours}:{minutes:02d}:{seconds:02d}"
+        # Only segments not already claimed by an earlier entry (still WAKE) take this stage
+        if first <= last:
+            segments[first:last + 1] = segments[first:last + 1].translate(WAKE_FILL_TABLES[code])
 
-def parse_duration_string(duration_str: str) -> timedelta:
-    hours, minutes, seconds = map(int, duration_str.split(':'))
-    return timedelta(hours=hours, minutes=minutes, seconds=seconds)
+def calculate_duration(start: datetime, end: datetime) -> timedelta:
+    return end - start
 
 def format_timedelta(td: timedelta) -> str:
-    total_seconds = int(td.total_seconds())
+    return format_seconds(int(td.total_seconds()))
+
+def format_seconds(total_seconds: int) -> str:
     hours = total_seconds // 3600
     minutes = (total_seconds % 3600) // 60
     seconds = total_seconds % 60
     return f"{hours}:{minutes:02d}:{seconds:02d}"
 
-def apply_time_shift(date_time: datetime, shift_seconds: int) -> datetime:
-    return date_time + timedelta(seconds=shift_seconds)
+# Fixed numeric formats built from the date fields directly, avoiding strftime
+def format_date(d) -> str:
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
+
+def format_hours_minutes(t, separator: str = ':') -> str:
+    return f"{t.hour:02d}{separator}{t.minute:02d}"
+
+def format_datetime(dt: datetime) -> str:
+    return f"{format_date(dt)}T{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
 
 def process_health_data(sleep_data: List[SleepEntry], output_file: str, from_date: datetime, to_date: datetime, time_shift_seconds: int):
-    sleep_data = sorted(sleep_data, key=lambda entry: entry.StartDate)
-    # Apply time shift
+    # Apply time shift, tracking the latest end and whether the entries are already in start order
+    time_shift = timedelta(seconds=time_shift_seconds)
+    end_time = sleep_data[0].EndDate + time_shift
+    previous_start = sleep_data[0].StartDate
+    in_order = True
     for entry in sleep_data:
-        entry.StartDate = apply_time_shift(entry.StartDate, time_shift_seconds)
-        entry.EndDate = apply_time_shift(entry.EndDate, time_shift_seconds)
+        if entry.StartDate < previous_start:
+            in_order = False
+        previous_start = entry.StartDate
+        if time_shift:
+            entry.StartDate += time_shift
+            entry.EndDate += time_shift
+        if entry.EndDate > end_time:
+            end_time = entry.EndDate
+
+    # Entries grouped by process_file are already sorted
+    if not in_order:
+        sleep_data = sorted(sleep_data, key=lambda entry: entry.StartDate)
 
     start_time = sleep_data[0].StartDate
-    end_time = max(entry.EndDate for entry in sleep_data)
 
-    print(f"Start Time: {start_time}")  # Debug output
-    print(f"End Time: {end_time}")      # Debug output
+    log.debug("Start Time: %s", start_time)
+    log.debug("End Time: %s", end_time)
 
     segments = create_30s_segments(start_time, end_time)
-    update_segments_with_sleep_data(segments, sleep_data)
+    update_segments_with_sleep_data(segments, start_time, sleep_data)
 
     total_duration = calculate_duration(start_time, end_time)
 
-    sleep_onset_segment = next((segment for segment in segments if segment.Stage != "WAKE"), segments[0])
-    sleep_onset_duration = calculate_duration(start_time, sleep_onset_segment.Start)
+    sleep_onset_index = next((i for i, code in enumerate(segments) if code != WAKE), 0)
+    sleep_onset_duration = sleep_onset_index * SEGMENT_SECONDS
 
-    stage_durations = {
-        "Asleep": timedelta(0),
-        "Light": timedelta(0),
-        "Deep": timedelta(0),
-        "REM": timedelta(0),
-        "WAKE": timedelta(0)
-    }
+    # Seconds spent in each stage; like sleep_onset_duration these are formatted only for output
+    stage_durations = {name: segments.count(code) * SEGMENT_SECONDS for code, name in enumerate(STAGE_NAMES)}
 
-    for segment in segments:
-        stage_durations[segment.Stage] += timedelta(seconds=30)
+    wake_after_sleep_onset = stage_durations["WAKE"] - sleep_onset_duration
 
-    wake_after_sleep_onset = stage_durations["WAKE"] - parse_duration_string(sleep_onset_duration)
+    # An awakening is a non-WAKE segment followed by a WAKE one, i.e. b"\x01\x00" in the sleep mask
+    num_awakenings = segments.translate(SLEEP_MASK).count(b"\x01\x00")
 
-    num_awakenings = sum(
-        1 for a, b in zip(segments, segments[1:])
-        if a.Stage != "WAKE" and b.Stage == "WAKE"
-    )
-
-    hypnogram = ",".join(segment.Stage for segment in segments)
+    hypnogram = ",".join(map(STAGE_NAMES.__getitem__, segments))
 
     output_data = OutputData()
     output_data.Type = "night"
-    output_data.StartTime = start_time.strftime("%Y-%m-%dT%H:%M:%S")
-    output_data.StopTime = end_time.strftime("%Y-%m-%dT%H:%M:%S")
-    output_data.SleepDuration = total_duration
-    output_data.SleepOnsetDuration = sleep_onset_duration
-    output_data.LightSleepDuration = format_timedelta(stage_durations["Light"])
-    output_data.DeepSleepDuration = format_timedelta(stage_durations["Deep"])
-    output_data.REMDuration = format_timedelta(stage_durations["REM"])
-    output_data.WakeAfterSleepOnsetDuration = format_timedelta(wake_after_sleep_onset)
+    output_data.StartTime = format_datetime(start_time)
+    output_data.StopTime = format_datetime(end_time)
+    output_data.SleepDuration = format_timedelta(total_duration)
+    output_data.SleepOnsetDuration = format_seconds(sleep_onset_duration)
+    output_data.LightSleepDuration = format_seconds(stage_durations["Light"])
+    output_data.DeepSleepDuration = format_seconds(stage_durations["Deep"])
+    output_data.REMDuration = format_seconds(stage_durations["REM"])
+    output_data.WakeAfterSleepOnsetDuration = format_seconds(wake_after_sleep_onset)
     output_data.NumberOfAwakenings = num_awakenings
     output_data.PositionChanges = 0
     output_data.MeanHeartRate = 0
@@ -178,13 +247,28 @@ def process_health_data(sleep_data: List[SleepEntry], output_file: str, from_dat
     output_data.SleepEfficiency = 0
     output_data.Hypnogram = f"[{hypnogram}]"
 
-    header = "Type;Start Time;Stop Time;Sleep Duration;Sleep Onset Duration;Light Sleep Duration;Deep Sleep Duration;REM Duration;Wake After Sleep Onset Duration;Number of awakenings;Position Changes;Mean Heart Rate;Mean Respiration CPM;Number of Stimulations;Sleep efficiency;Hypnogram"
-
-    data_row = f"{output_data.Type};{output_data.StartTime};{output_data.StopTime};{output_data.SleepDuration};{output_data.SleepOnsetDuration};{output_data.LightSleepDuration};{output_data.DeepSleepDuration};{output_data.REMDuration};{output_data.WakeAfterSleepOnsetDuration};{output_data.NumberOfAwakenings};{output_data.PositionChanges};{output_data.MeanHeartRate};{output_data.MeanRespirationCPM};{output_data.NumberOfStimulations};{output_data.SleepEfficiency};{output_data.Hypnogram}"
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(header + '\n')
-        f.write(data_row)
+    data_row = ";".join((
+        output_data.Type,
+        output_data.StartTime,
+        output_data.StopTime,
+        output_data.SleepDuration,
+        output_data.SleepOnsetDuration,
+        output_data.LightSleepDuration,
+        output_data.DeepSleepDuration,
+        output_data.REMDuration,
+        output_data.WakeAfterSleepOnsetDuration,
+        str(output_data.NumberOfAwakenings),
+        str(output_data.PositionChanges),
+        str(output_data.MeanHeartRate),
+        str(output_data.MeanRespirationCPM),
+        str(output_data.NumberOfStimulations),
+        str(output_data.SleepEfficiency),
+        output_data.Hypnogram,
+    ))
+
+    # The hypnogram makes the row tens of KB long; buffer it so it reaches the file in one write
+    with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+        f.writelines((OUTPUT_HEADER, '\n', data_row))
 
 def validate_sleep_data(sleep_data: List[SleepEntry], file_name: str) -> bool:
     if not sleep_data:
@@ -218,14 +302,16 @@ def get_unique_file_name(file_name: str) -> str:
     file_name_only, extension = os.path.splitext(os.path.basename(file_name))
     path = os.path.dirname(file_name)
     count = 1
-    new_full_path = file_name
 
-    while os.path.exists(new_full_path):
-        temp_file_name = f"{file_name_only}_{count}"
-        new_full_path = os.path.join(path, temp_file_name + extension)
+    # List the directory once instead of calling exists() for every candidate name. The final
+    # exists() check covers case-insensitive file systems that normcase does not account for.
+    existing = {os.path.normcase(name) for name in os.listdir(path or '.')}
+    temp_file_name = f"{file_name_only}_{count}{extension}"
+    while os.path.normcase(temp_file_name) in existing or os.path.exists(os.path.join(path, temp_file_name)):
         count += 1
+        temp_file_name = f"{file_name_only}_{count}{extension}"
 
-    return new_full_path
+    return os.path.join(path, temp_file_name)
 
 def parse_datetime(input_str: str) -> datetime:
     if not input_str:
@@ -233,52 +319,91 @@ def parse_datetime(input_str: str) -> datetime:
     try:
         dt = date_parser.parse(input_str)
         if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=tz.tzlocal())
+            dt = dt.replace(tzinfo=LOCAL_TZ)
         return dt
     except ValueError:
         print(f"Invalid date format: {input_str}.")
         return None
 
-def process_file(input_file: str, output_folder: str, from_date: datetime, to_date: datetime, time_shift_seconds: int, input_type: str, rename: bool, use_source: str = None):
-    print(f"Processing file: {input_file}")
-    
-    if input_type == 'json': # Support for "Health Auto Export - JSON+CSV" iOS App, json files are expected
+def json_sleep_entry(entry: dict) -> SleepEntry:
+    return SleepEntry(
+        source=entry.get('source', ''),
+        qty=entry.get('qty', 0),
+        start_date=parse_iso8601(entry.get('startDate', '')),
+        value=entry.get('value', ''),
+        end_date=parse_iso8601(entry.get('endDate', '')),
+    )
 
-        try:
-            with open(input_file, 'r', encoding='utf-8') as f:
-                json_string = f.read()
-        except Exception as ex:
-            print(f"Warning: Unable to read file {input_file}. Error: {ex}")
-            return
+def load_json_sleep_entries(input_file: str) -> List[SleepEntry]:
+    try:
+        with open(input_file, 'rb') as f:
+            json_bytes = f.read()
+    except Exception as ex:
+        print(f"Warning: Unable to read file {input_file}. Error: {ex}")
+        return None
 
-        try:
-            health_data_dict = json.loads(json_string)
-        except json.JSONDecodeError as ex:
-            print(f"Warning: Invalid JSON in file {input_file}. Error: {ex}")
-            return
+    try:
+        health_data_dict = json_loads(json_bytes)
+    except (json.JSONDecodeError, UnicodeDecodeError) as ex:
+        print(f"Warning: Invalid JSON in file {input_file}. Error: {ex}")
+        return None
+
+    if 'data' not in health_data_dict or 'metrics' not in health_data_dict['data']:
+        print(f"Warning: The file {input_file} does not contain valid health data.")
+        return None
+
+    metrics_list = health_data_dict['data']['metrics']
+    if not metrics_list or 'data' not in metrics_list[0]:
+        print(f"Warning: No sleep data found in file {input_file}.")
+        return None
+
+    return [json_sleep_entry(entry) for entry in metrics_list[0]['data']]
 
-        if 'data' not in health_data_dict or 'metrics' not in health_data_dict['data']:
-            print(f"Warning: The file {input_file} does not contain valid health data.")
+def first_metric_events(f, seen_prefixes: set):
+    # Parse events up to the end of the first metric, recording which parts of the document were seen
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        seen_prefixes.add(prefix)
+        yield prefix, event, value
+        if prefix == 'data.metrics.item' and event == 'end_map':
             return
 
-        metrics_list = health_data_dict['data']['metrics']
-        if not metrics_list or 'data' not in metrics_list[0]:
-            print(f"Warning: No sleep data found in file {input_file}.")
+def stream_json_sleep_entries(input_file: str) -> List[SleepEntry]:
+    # Same result as load_json_sleep_entries, but builds each entry as it is parsed so the
+    # whole document is never held in memory
+    seen_prefixes = set()
+    try:
+        with open(input_file, 'rb') as f:
+            events = first_metric_events(f, seen_prefixes)
+            sleep_entries = [json_sleep_entry(entry) for entry in ijson.items(events, 'data.metrics.item.data.item')]
+    except ijson.JSONError as ex:
+        print(f"Warning: Invalid JSON in file {input_file}. Error: {ex}")
+        return None
+    except Exception as ex:
+        print(f"Warning: Unable to read file {input_file}. Error: {ex}")
+        return None
+
+    if 'data.metrics' not in seen_prefixes:
+        print(f"Warning: The file {input_file} does not contain valid health data.")
+        return None
+
+    if 'data.metrics.item.data' not in seen_prefixes:
+        print(f"Warning: No sleep data found in file {input_file}.")
+        return None
+
+    return sleep_entries
+
+def process_file(input_file: str, output_folder: str, from_date: datetime, to_date: datetime, time_shift_seconds: int, input_type: str, rename: bool, use_source: str = None):
+    log.info("Processing file: %s", input_file)
+    
+    if input_type == 'json': # Support for "Health Auto Export - JSON+CSV" iOS App, json files are expected
+
+        if ijson is not None and os.path.isfile(input_file) and os.path.getsize(input_file) >= JSON_STREAMING_THRESHOLD:
+            sleep_entries = stream_json_sleep_entries(input_file)
+        else:
+            sleep_entries = load_json_sleep_entries(input_file)
+        if sleep_entries is None:
             return
 
-        sleep_data_list = metrics_list[0]['data']
-
-        sleep_entries = []
-        for entry in sleep_data_list:
-            sleep_entry = SleepEntry(
-                source=entry.get('source', ''),
-                qty=entry.get('qty', 0),
-                start_date=parse_iso8601(entry.get('startDate', '')),
-                value=entry.get('value', ''),
-                end_date=parse_iso8601(entry.get('endDate', '')),
-            )
-            sleep_entries.append(sleep_entry)
-            
     elif input_type == 'csv': # Support for "Simple Health Export CSV" iOS App format, CSV files are expected to be in ZIP archives
         
         try:
@@ -303,10 +428,10 @@ def process_file(input_file: str, output_folder: str, from_date: datetime, to_da
                             csvreader = csv.DictReader(f, delimiter=',', quotechar='"')
                             # columns: type,sourceName,sourceVersion,productType,device,startDate,endDate,value,HKTimeZone
                             for row in csvreader:
-                                time_zone = row['HKTimeZone']
+                                time_zone = ZoneInfo(row['HKTimeZone'])
                                 source = row['sourceName']
-                                start_date = parse_iso8601(row['startDate']).astimezone(ZoneInfo(time_zone))
-                                end_date = parse_iso8601(row['endDate']).astimezone(ZoneInfo(time_zone))
+                                start_date = parse_iso8601(row['startDate']).astimezone(time_zone)
+                                end_date = parse_iso8601(row['endDate']).astimezone(time_zone)
                                 value = health_export_csv_map_sleep_stage(row['value'])
                                 qty = (end_date - start_date).total_seconds()/3600.0
                                 sleep_entry = SleepEntry(
@@ -358,49 +483,49 @@ def process_file(input_file: str, output_folder: str, from_date: datetime, to_da
 
     all_sleep_data = sorted(sleep_entries, key=lambda x: x.StartDate)
 
-    # Define start_time and end_time as datetime.time objects
-    start_time = time(hour=19, minute=0, second=0)
+    # Nights run from 19:00 until 11:00 the next day, so an entry belongs to the night of the
+    # date 19 hours before its start
+    night_start_offset = timedelta(hours=19)
     end_time = time(hour=11, minute=0, second=0)
 
-    grouped_sleep_data = []
-    current_night_start = None
-    current_night_entries = []
+    # Entries are sorted by start, so entries starting before from_date can be skipped with a binary
+    # search, and the scan can stop at the first entry starting after to_date
+    first_in_range = bisect_left([entry.StartDate for entry in all_sleep_data], from_date)
+    in_range_sleep_data = takewhile(lambda entry: entry.StartDate <= to_date, all_sleep_data[first_in_range:])
 
-    for entry in all_sleep_data:
-        start_dt = entry.StartDate
-        end_dt = entry.EndDate
+    grouped_sleep_data = []
 
-        # Determine the night date
-        if start_dt.time() >= start_time:
-            night_date = start_dt.date()
-        else:
-            night_date = (start_dt - timedelta(days=1)).date()
+    for night_date, night_entries in groupby(in_range_sleep_data, key=lambda entry: (entry.StartDate - night_start_offset).date()):
+        current_night_entries = []
+        night_end_dt = None
 
-        # Calculate night_start_dt and night_end_dt
-        night_start_dt = datetime.combine(night_date, start_time, tzinfo=start_dt.tzinfo)
-        night_end_dt = datetime.combine(night_date + timedelta(days=1), end_time, tzinfo=start_dt.tzinfo)
+        for entry in night_entries:
+            # Entries of one night normally share a time zone, so the night end is rarely rebuilt
+            if night_end_dt is None or night_end_dt.tzinfo is not entry.StartDate.tzinfo:
+                night_end_dt = datetime.combine(night_date + timedelta(days=1), end_time, tzinfo=entry.StartDate.tzinfo)
 
-        # Filter entries within the night and date range
-        if (start_dt >= night_start_dt and end_dt <= night_end_dt and
-            start_dt >= from_date and end_dt <= to_date):
-            if current_night_start != night_date:
-                if current_night_entries:
-                    grouped_sleep_data.append((current_night_start, current_night_entries))
-                current_night_start = night_date
-                current_night_entries = []
-            current_night_entries.append(entry)
+            # Filter entries within the night and date range
+            if entry.EndDate <= night_end_dt and entry.EndDate <= to_date:
+                current_night_entries.append(entry)
 
-    if current_night_entries:
-        grouped_sleep_data.append((current_night_start, current_night_entries))
+        if not current_night_entries:
+            continue
+        # Entries with mixed UTC offsets can interleave nights; rejoin a night split only by filtered entries
+        if grouped_sleep_data and grouped_sleep_data[-1][0] == night_date:
+            grouped_sleep_data[-1][1].extend(current_night_entries)
+        else:
+            grouped_sleep_data.append((night_date, current_night_entries))
 
     for night_date, entries in grouped_sleep_data:
         segment_start_date = min(entry.StartDate for entry in entries)
         segment_end_date = max(entry.EndDate for entry in entries)
 
+        night = format_date(night_date)
         output_file = os.path.join(output_folder,
-            f"Apple2Dreem_{night_date.strftime('%Y-%m-%d')}_{segment_start_date.strftime('%H-%M')}_{segment_end_date.strftime('%H-%M')}.csv")
+            f"Apple2Dreem_{night}_{format_hours_minutes(segment_start_date, '-')}_{format_hours_minutes(segment_end_date, '-')}.csv")
         process_health_data(entries, output_file, segment_start_date, segment_end_date, time_shift_seconds)
-        print(f"Processed data for night of {night_date.strftime('%Y-%m-%d')} from {segment_start_date.strftime('%H:%M')} to {segment_end_date.strftime('%H:%M')}. Output saved to {output_file}")
+        log.info("Processed data for night of %s from %s to %s. Output saved to %s",
+                 night, format_hours_minutes(segment_start_date), format_hours_minutes(segment_end_date), output_file)
     if rename:
       try:
           new_file_name = get_unique_file_name(os.path.join(os.path.dirname(input_file), "_" + os.path.basename(input_file)))
@@ -409,6 +534,10 @@ def process_file(input_file: str, output_folder: str, from_date: datetime, to_da
       except Exception as ex:
           print(f"Warning: Unable to rename processed file {input_file}. Error: {ex}")
 
+def configure_logging(level: int):
+    # Also run in each worker process, which does not inherit the configuration on spawn-based platforms
+    logging.basicConfig(level=level, format="%(message)s", stream=sys.stdout)
+
 def main():
     parser = argparse.ArgumentParser(description='AppleWatch2Dreem')
 
@@ -421,9 +550,13 @@ def main():
     parser.add_argument('-y', '--type', help='Specify input file type: json (Health Auto Export app) or csv (Simple Health Export CSV app) (default: json)', default='json')
     parser.add_argument('-r', '--rename', help='Specify whether to rename the input file upon completion (default: true)', default='true')
     parser.add_argument('-u', '--use-source', dest='use_source', help='Only process entries from this source when multiple sources are present')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print debug output such as the start and end time of each night')
 
     args = parser.parse_args()
 
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+    configure_logging(log_level)
+
     input_folder = args.input
     output_folder = args.output
     file_filter = args.filter
@@ -439,18 +572,18 @@ def main():
 
     # Set default from_date and to_date with timezone
     if not from_date:
-        from_date = datetime.now(tz=tz.tzlocal()).replace(hour=19, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        from_date = datetime.now(tz=LOCAL_TZ).replace(hour=19, minute=0, second=0, microsecond=0) - timedelta(days=1)
     elif from_date.time() == time(0, 0, 0):
         from_date = from_date.replace(hour=19, minute=0, second=0, microsecond=0)
     if from_date.tzinfo is None:
-        from_date = from_date.replace(tzinfo=tz.tzlocal())
+        from_date = from_date.replace(tzinfo=LOCAL_TZ)
 
     if not to_date:
-        to_date = datetime.now(tz=tz.tzlocal()).replace(hour=11, minute=0, second=0, microsecond=0)
+        to_date = datetime.now(tz=LOCAL_TZ).replace(hour=11, minute=0, second=0, microsecond=0)
     elif to_date.time() == time(0, 0, 0):
         to_date = to_date.replace(hour=11, minute=0, second=0, microsecond=0)
     if to_date.tzinfo is None:
-        to_date = to_date.replace(tzinfo=tz.tzlocal())
+        to_date = to_date.replace(tzinfo=LOCAL_TZ)
         
     if not (input_type=='json' or input_type =='csv'):
         print (f"Error: invalid type '{input_type}'; must be 'json' or 'csv'")
@@ -480,16 +613,24 @@ def main():
     skipped_files = 0
     failed_files = 0
 
-    for file in files:
-        try:
-            process_file(file, output_folder, from_date, to_date, time_shift_seconds, input_type, rename, use_source)
-            processed_files += 1
-        except SkipProcessing as ex:
-            print(f"Skipped {file}: {ex}")
-            skipped_files += 1
-        except Exception as ex:
-            print(f"Warning: Failed to process file {file}. Error: {ex}")
-            failed_files += 1
+    # Files are independent of each other, so process them in parallel
+    with ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1),
+                             initializer=configure_logging, initargs=(log_level,)) as executor:
+        futures = {
+            executor.submit(process_file, file, output_folder, from_date, to_date, time_shift_seconds, input_type, rename, use_source): file
+            for file in files
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                future.result()
+                processed_files += 1
+            except SkipProcessing as ex:
+                print(f"Skipped {file}: {ex}")
+                skipped_files += 1
+            except Exception as ex:
+                print(f"Warning: Failed to process file {file}. Error: {ex}")
+                failed_files += 1
 
     print(f"Processing complete. Processed files: {processed_files}, Skipped files: {skipped_files}, Failed files: {failed_files}")
 